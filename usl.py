@@ -2,26 +2,41 @@
 """Unity Script Library (USL) — manage scripts and packages in Unity projects."""
 
 import argparse
-import difflib
+import contextlib
+import functools
 import json
 import logging
 import os
 import re
 import shutil
-import subprocess
+import stat
 import sys
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, FrozenSet, Iterator, List, Optional, Set, Tuple, Union
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
-LIBRARY_DIR = Path(__file__).parent.resolve()
-SCRIPTS_DIR = LIBRARY_DIR / "scripts"
+StrPath = Union[str, "os.PathLike[str]"]
+
 UNITY_PACKAGES_MANIFEST = "Packages/manifest.json"
 SKIP_FILES = frozenset(['dependencies.txt', '.DS_Store', 'Thumbs.db', 'desktop.ini'])
 DEP_NAME_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9_-]*$")
 PACKAGE_ID_PATTERN = re.compile(r"^[a-z][a-z0-9-]*(\.[a-z][a-z0-9-]*){2,}$")
+DEPS_LINE_PATTERN = re.compile(
+    r"^[^\S\n]*(?:-[^\S\n]*(?P<dep>[^\n]*?)|(?P<section>scripts|packages):)[^\S\n]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+SELECTION_SEPARATOR = re.compile(r"[,\s]+")
+COPY_CHUNK_SIZE = 64 * 1024
+PARALLEL_COPY_THRESHOLD = 16
+_ACTIVE, _DONE = 1, 2  # DFS colors
+_YES = frozenset({"y", "yes"})
+_NO = frozenset({"n", "no"})
+_MANIFEST_ENCODER = json.JSONEncoder(indent=2, ensure_ascii=False)
+
+# Parsed dependencies.txt contents keyed by path, stamped with (mtime_ns, size)
+_DEPS_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, Tuple[str, ...]]]] = {}
 
 
 # --- Exceptions ---
@@ -38,91 +53,139 @@ class InvalidDependencyFileError(USLError):
 class ManifestError(USLError):
     """Issue with the Unity manifest."""
 
+class CyclicDependencyError(USLError):
+    """Script dependencies form a cycle."""
+
 
 # --- Transaction ---
 
 class InstallationTransaction:
     """Context manager for safe installations with rollback."""
 
-    def __init__(self, manifest_path: Path):
+    def __init__(self, manifest_path: Path, assets_dir: StrPath):
         self.manifest_path = manifest_path
+        self.assets_dir = assets_dir
+        self._assets_prefix = os.path.join(os.fspath(assets_dir), "")
         self.backup_path = manifest_path.with_suffix('.backup')
-        self.tracked_files: List[Tuple[Path, Optional[Path]]] = []
-        self.tracked_dirs: List[Path] = []
+        self.dest_paths: List[str] = []
+        self.backup_paths: List[Optional[str]] = []
+        self.tracked_dirs: Dict[str, None] = {}  # ordered set
         self.committed = False
+        self._manifest_backed_up = False
 
     def __enter__(self):
-        if self.manifest_path.exists():
-            shutil.copy2(self.manifest_path, self.backup_path)
         return self
 
-    def track_file_operation(self, dest_path: Path, original_backup: Optional[Path] = None) -> None:
-        self.tracked_files.append((dest_path, original_backup))
+    def backup_manifest(self) -> None:
+        """Back up the manifest before it is rewritten."""
+        self.backup_path.unlink(missing_ok=True)  # stale backup from an interrupted run
+        try:
+            os.link(self.manifest_path, self.backup_path)
+        except FileNotFoundError:
+            pass  # no manifest yet, nothing to back up
+        except OSError:
+            shutil.copy2(self.manifest_path, self.backup_path)
+        self._manifest_backed_up = True
+
+    def track_file_operation(self, dest_path: str, original_backup: Optional[str] = None) -> None:
+        self.dest_paths.append(os.fspath(dest_path))
+        self.backup_paths.append(os.fspath(original_backup) if original_backup is not None else None)
 
-    def track_directory_creation(self, dir_path: Path) -> None:
-        if dir_path not in self.tracked_dirs:
-            self.tracked_dirs.append(dir_path)
+    def track_directory_creation(self, dir_path: str) -> None:
+        self.tracked_dirs[os.fspath(dir_path)] = None
 
     def commit(self):
         """Mark transaction as successful — no rollback needed."""
         self.committed = True
-        if self.backup_path.exists():
-            self.backup_path.unlink()
-        for _dest, backup in self.tracked_files:
-            if backup and backup.exists():
-                backup.unlink()
-        self.tracked_files.clear()
+        if self._manifest_backed_up:
+            self.backup_path.unlink(missing_ok=True)
+        for backup in self.backup_paths:
+            if backup is not None:
+                try:
+                    os.unlink(backup)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not remove backup {self._display(backup)}: {e}")
+        self.dest_paths.clear()
+        self.backup_paths.clear()
         self.tracked_dirs.clear()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type is not None and not self.committed:
             logger.error("\n✗ Error occurred! Rolling back changes...")
 
-            if self.backup_path.exists():
-                if self.manifest_path.exists():
-                    self.manifest_path.unlink()
-                self.backup_path.replace(self.manifest_path)
-                logger.info("  Restored manifest backup")
-
-            for dest_path, backup_path in reversed(self.tracked_files):
+            restored: List[str] = []
+            failed: List[str] = []
+            if self._manifest_backed_up:
+                try:
+                    unchanged = os.path.samefile(self.backup_path, self.manifest_path)
+                except OSError:
+                    unchanged = False
+                if unchanged:
+                    self.backup_path.unlink(missing_ok=True)
+                else:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.replace(self.backup_path, self.manifest_path)
+                        restored.append("  Restored manifest backup")
+
+            for dest_path, backup_path in zip(reversed(self.dest_paths), reversed(self.backup_paths)):
                 try:
-                    if backup_path and backup_path.exists():
-                        backup_path.replace(dest_path)
-                        logger.info(f"  Restored: {self._display(dest_path)}")
-                    elif dest_path.exists():
-                        dest_path.unlink()
-                        logger.info(f"  Removed: {self._display(dest_path)}")
-                except Exception as e:
-                    logger.warning(f"  Could not roll back {dest_path.name}: {e}")
+                    if backup_path is not None:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.replace(backup_path, dest_path)
+                            restored.append(f"  Restored: {self._display(dest_path)}")
+                            continue
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(dest_path)
+                        restored.append(f"  Removed: {self._display(dest_path)}")
+                except OSError as e:
+                    failed.append(f"  Could not roll back {self._display(dest_path)}: {e}")
 
             for dir_path in reversed(self.tracked_dirs):
-                try:
-                    if dir_path.exists() and not any(dir_path.iterdir()):
-                        dir_path.rmdir()
-                except OSError:
-                    pass
+                with contextlib.suppress(OSError):
+                    os.rmdir(dir_path)
 
+            if restored:
+                logger.info("\n".join(restored))
+            if failed:
+                logger.warning("\n".join(failed))
             logger.info("Rollback complete.")
         return False
 
-    def _display(self, file_path: Path) -> str:
+    def _display(self, file_path: str) -> str:
         """Return a path relative to the Assets folder, or the full path."""
-        for p in file_path.parents:
-            if p.name == "Assets":
-                try:
-                    return str(file_path.relative_to(p))
-                except ValueError:
-                    pass
-        return str(file_path)
+        if file_path.startswith(self._assets_prefix):
+            return file_path[len(self._assets_prefix):]
+        return file_path
 
 
 # --- Helpers ---
 
+@functools.lru_cache(maxsize=1)
+def _scripts_dir() -> Path:
+    """Return the library's scripts folder."""
+    return Path(os.path.realpath(__file__)).parent / "scripts"
+
+@functools.lru_cache(maxsize=8)
+def _project_flags(path: str) -> Tuple[bool, bool, bool]:
+    """Return (has Assets, has ProjectSettings, has .git) from one directory listing."""
+    found = set()
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name in ("Assets", "ProjectSettings", ".git") and entry.is_dir():
+                    found.add(entry.name)
+    except OSError:
+        pass
+    return "Assets" in found, "ProjectSettings" in found, ".git" in found
+
 def is_unity_project(path: Path) -> bool:
-    return (path / "Assets").is_dir() and (path / "ProjectSettings").is_dir()
+    has_assets, has_settings, _ = _project_flags(str(path))
+    return has_assets and has_settings
 
 def is_git_repo(path: Path) -> bool:
-    return (path / ".git").is_dir()
+    return _project_flags(str(path))[2]
 
 def prompt_yes_no(question: str, assume_yes: bool = False) -> bool:
     if assume_yes:
@@ -133,98 +196,143 @@ def prompt_yes_no(question: str, assume_yes: bool = False) -> bool:
         except (EOFError, KeyboardInterrupt):
             logger.info("\nCancelled.")
             return False
-        if answer in ("y", "yes"):
+        if answer in _YES:
             return True
-        if answer in ("n", "no"):
+        if answer in _NO:
             return False
         print("Please answer y or n.")
 
-def validate_dependency_name(name: str) -> bool:
-    return bool(DEP_NAME_PATTERN.fullmatch(name))
+def prompt_choice(question: str, choices: Tuple[str, ...]) -> Optional[str]:
+    """Ask until one of choices is given (in full or by first letter); None if cancelled."""
+    by_key = {c[0]: c for c in choices}
+    by_key.update((c, c) for c in choices)
+    options = " / ".join(f"({c[0]}){c[1:]}" for c in choices)
+    while True:
+        try:
+            answer = input(f"{question} {options}: ").strip().lower()
+        except (EOFError, KeyboardInterrupt):
+            logger.info("\nCancelled.")
+            return None
+        if answer in by_key:
+            return by_key[answer]
+        print(f"Please answer one of: {', '.join(choices)}.")
 
-def validate_package_id(package_id: str) -> bool:
-    return bool(PACKAGE_ID_PATTERN.fullmatch(package_id))
+validate_dependency_name = DEP_NAME_PATTERN.fullmatch
+validate_package_id = PACKAGE_ID_PATTERN.fullmatch
 
 def parse_dependencies_file(package_path: Path) -> Dict[str, List[str]]:
     """Parse dependencies.txt and return {'scripts': [...], 'packages': [...]}."""
     deps_path = package_path / "dependencies.txt"
-    if not deps_path.is_file():
+    try:
+        st = deps_path.stat()
+    except OSError:
+        return {"scripts": [], "packages": []}
+    if not stat.S_ISREG(st.st_mode):
         return {"scripts": [], "packages": []}
 
+    key = str(deps_path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = _DEPS_CACHE.get(key)
+    if entry is not None and entry[0] == stamp:
+        cached = entry[1]
+    else:
+        parsed = _read_dependencies_file(deps_path, package_path.name)
+        cached = {k: tuple(v) for k, v in parsed.items()}
+        _DEPS_CACHE[key] = (stamp, cached)
+    return {k: list(v) for k, v in cached.items()}
+
+def _read_dependencies_file(deps_path: Path, package_name: str) -> Dict[str, List[str]]:
+    """Read and validate a dependencies.txt file (uncached)."""
     results: Dict[str, List[str]] = {"scripts": [], "packages": []}
-    validators = {
-        "scripts": (validate_dependency_name, "script dependency name"),
-        "packages": (validate_package_id, "Unity package ID"),
+    # section -> (validator, label, output list)
+    sections = {
+        "scripts": (validate_dependency_name, "script dependency name", results["scripts"]),
+        "packages": (validate_package_id, "Unity package ID", results["packages"]),
     }
     sections_seen: Set[str] = set()
     current_section: Optional[str] = None
+    validate_fn, label, entries = None, None, None
     seen_in_section: Set[str] = set()
 
     try:
-        with open(deps_path, "r", encoding="utf-8") as f:
-            for line_num, line in enumerate(f, 1):
-                stripped = line.strip()
-                if not stripped or stripped.startswith("#"):
-                    continue
-
-                lower = stripped.lower()
-                if lower in ("scripts:", "packages:"):
-                    section = lower[:-1]  # strip the trailing ":"
-                    if section in sections_seen:
-                        raise InvalidDependencyFileError(
-                            f"Duplicate '{section}:' section at line {line_num} in {deps_path}"
-                        )
-                    sections_seen.add(section)
-                    current_section = section
-                    seen_in_section = set()
-                    continue
-
-                if current_section and stripped.startswith("-"):
-                    name = stripped[1:].strip()
-                    validate_fn, label = validators[current_section]
-                    if not validate_fn(name):
-                        logger.warning(
-                            f"Invalid {label} '{name}' in {deps_path.name} line {line_num}. Skipping."
-                        )
-                    elif name in seen_in_section:
-                        logger.warning(
-                            f"Duplicate {current_section} dependency '{name}' "
-                            f"in {deps_path.name} line {line_num}. Skipping."
-                        )
-                    else:
-                        seen_in_section.add(name)
-                        results[current_section].append(name)
+        text = deps_path.read_text(encoding="utf-8")
     except IOError as e:
         raise InvalidDependencyFileError(
-            f"Cannot read dependencies file for '{package_path.name}': {e}"
+            f"Cannot read dependencies file for '{package_name}': {e}"
         )
 
+    def line_of(m: "re.Match[str]") -> int:
+        """Line number of a match."""
+        return text.count("\n", 0, m.start()) + 1
+
+    for m in DEPS_LINE_PATTERN.finditer(text):
+        name = m["dep"]
+        if name is not None:
+            if not current_section:
+                continue
+            if not validate_fn(name):
+                logger.warning(
+                    f"Invalid {label} '{name}' in {deps_path.name} line {line_of(m)}. Skipping."
+                )
+            elif name in seen_in_section:
+                logger.warning(
+                    f"Duplicate {current_section} dependency '{name}' "
+                    f"in {deps_path.name} line {line_of(m)}. Skipping."
+                )
+            else:
+                seen_in_section.add(name)
+                entries.append(name)
+            continue
+
+        section = m["section"].lower()
+        if section in sections_seen:
+            raise InvalidDependencyFileError(
+                f"Duplicate '{section}:' section at line {line_of(m)} in {deps_path}"
+            )
+        sections_seen.add(section)
+        current_section = section
+        validate_fn, label, entries = sections[section]
+        seen_in_section = set()
+
     return results
 
+def _fsync_dir(dir_path: Path) -> None:
+    """Flush a directory entry to disk (best-effort)."""
+    try:
+        fd = os.open(dir_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
 def write_manifest_atomic(manifest_path: Path, manifest_data: dict) -> None:
     """Write the Unity manifest via a temp file for safety (atomic on POSIX, best-effort on Windows)."""
     tmp = manifest_path.with_suffix(".tmp")
+    payload = _MANIFEST_ENCODER.encode(manifest_data).encode("utf-8")
     try:
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(manifest_data, f, indent=2)
-        with open(tmp, "r", encoding="utf-8") as f:
-            json.load(f)  # validate before committing
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
         os.replace(tmp, manifest_path)
-    except (IOError, OSError) as e:
-        if tmp.exists():
-            tmp.unlink()
+    except OSError as e:
+        tmp.unlink(missing_ok=True)
         raise ManifestError(f"Failed to write manifest '{manifest_path}': {e}")
-    except json.JSONDecodeError as e:
-        if tmp.exists():
-            tmp.unlink()
-        raise ManifestError(f"Generated invalid JSON for manifest '{manifest_path}': {e}")
+    _fsync_dir(manifest_path.parent)
 
 def load_manifest(manifest_path: Path) -> Dict:
-    if not manifest_path.exists():
-        raise ManifestError(f"Unity package manifest not found at: {manifest_path}")
     try:
-        with open(manifest_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return json.loads(manifest_path.read_bytes())
+    except FileNotFoundError:
+        raise ManifestError(f"Unity package manifest not found at: {manifest_path}")
     except (IOError, OSError) as e:
         raise ManifestError(f"Error reading manifest '{manifest_path}': {e}")
     except json.JSONDecodeError as e:
@@ -233,88 +341,237 @@ def load_manifest(manifest_path: Path) -> Dict:
 
 # --- Core Logic ---
 
-def scan_scripts(scripts_dir: Path) -> List[Path]:
-    if not scripts_dir.exists():
-        return []
-    return sorted([f for f in scripts_dir.iterdir() if f.is_dir()], key=lambda f: f.name.lower())
+def scan_scripts(scripts_dir: Path) -> Dict[str, Path]:
+    """Return {package name: package folder}, ordered case-insensitively by name."""
+    try:
+        mtime_ns = scripts_dir.stat().st_mtime_ns
+    except OSError:
+        return {}
+    return dict(_scan_scripts_cached(str(scripts_dir), mtime_ns))
+
+@functools.lru_cache(maxsize=4)
+def _scan_scripts_cached(scripts_dir: str, mtime_ns: int) -> Dict[str, Path]:
+    """List package folders; mtime_ns only keys the cache."""
+    with os.scandir(scripts_dir) as it:
+        folders = [(entry.name.lower(), entry.name, entry.path) for entry in it if entry.is_dir()]
+    folders.sort()
+    return {name: Path(path) for _, name, path in folders}
+
+def _with_suggestions(msg: str, name: str, candidates: Tuple[str, ...]) -> str:
+    """Append the closest matches for name among candidates to msg, if any."""
+    if not candidates:
+        return msg
+    import difflib  # only needed on this error path
+    initial = name[:1].casefold()
+    bucket = [c for c in candidates if c[:1].casefold() == initial]
+    suggestions = difflib.get_close_matches(name, bucket, n=3, cutoff=0.6) if bucket else []
+    if not suggestions:
+        suggestions = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+    if suggestions:
+        msg += "\nDid you mean one of these?\n" + "\n".join(f"  - {s}" for s in suggestions)
+    return msg
 
 def resolve_script_dependencies(
-    script_path: Path,
-    name_map: Dict[str, Path],
-    visited: Optional[Set[Path]] = None
-) -> Tuple[Set[Path], Set[str]]:
-    """Recursively resolve all script and package dependencies."""
-    if visited is None:
-        visited = set()
-    if script_path in visited:
-        return set(), set()
-
-    visited.add(script_path)
-    scripts = {script_path}
+    script_names: List[str],
+    name_map: Dict[str, Path]
+) -> Tuple[List[Path], Set[str]]:
+    """Resolve script and package dependencies; scripts come back in dependency order."""
+    color: Dict[str, int] = {}
+    order: List[str] = []
     packages: Set[str] = set()
 
-    deps = parse_dependencies_file(script_path)
-    packages.update(deps["packages"])
-
-    for dep_name in deps["scripts"]:
-        if dep_name not in name_map:
-            suggestions = difflib.get_close_matches(dep_name, name_map.keys(), n=3, cutoff=0.6)
-            msg = f"Script '{dep_name}' (required by '{script_path.name}') not found."
-            if suggestions:
-                msg += "\nDid you mean one of these?\n" + "\n".join(f"  - {s}" for s in suggestions)
-            raise DependencyNotFoundError(msg)
+    def script_deps(name: str) -> Iterator[str]:
+        deps = parse_dependencies_file(name_map[name])
+        packages.update(deps["packages"])
+        for dep_name in deps["scripts"]:
+            if dep_name not in name_map:
+                raise DependencyNotFoundError(_with_suggestions(
+                    f"Script '{dep_name}' (required by '{name}') not found.",
+                    dep_name, tuple(name_map),
+                ))
+        return iter(deps["scripts"])
+
+    for root in script_names:
+        if root in color:
+            continue
+        color[root] = _ACTIVE
+        stack = [(root, script_deps(root))]
+        while stack:
+            name, children = stack[-1]
+            for dep_name in children:
+                state = color.get(dep_name)
+                if state is None:
+                    color[dep_name] = _ACTIVE
+                    stack.append((dep_name, script_deps(dep_name)))
+                    break
+                if state == _ACTIVE:
+                    path = [n for n, _ in stack]
+                    cycle = path[path.index(dep_name):] + [dep_name]
+                    raise CyclicDependencyError(
+                        f"Circular script dependency: {' -> '.join(cycle)}"
+                    )
+            else:
+                stack.pop()
+                color[name] = _DONE
+                order.append(name)
+
+    return [name_map[name] for name in order], packages
+
+def _walk_package(
+    root: str,
+    skip: FrozenSet[str] = SKIP_FILES,
+    rel_dir: str = ""
+) -> Iterator[Tuple[str, str, str]]:
+    """Yield (src_path, rel_dir, name) for each file under root."""
+    subdirs = []
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry)
+            elif entry.name not in skip and not entry.is_dir():
+                yield entry.path, rel_dir, entry.name
+    for entry in subdirs:
+        yield from _walk_package(entry.path, skip, rel_dir + entry.name + os.sep)
+
+def _existing_names(dir_path: str) -> Optional[Set[str]]:
+    """Return the casefolded entry names in dir_path, or None if it can't be listed."""
+    try:
+        with os.scandir(dir_path) as it:
+            return {entry.name.casefold() for entry in it}
+    except OSError:
+        return None
 
-        dep_scripts, dep_packages = resolve_script_dependencies(name_map[dep_name], name_map, visited)
-        scripts.update(dep_scripts)
-        packages.update(dep_packages)
+def _same_contents(src: str, dest: str) -> bool:
+    """Return True if dest is a regular file with exactly src's bytes."""
+    try:
+        src_st, dest_st = os.stat(src), os.stat(dest)
+    except OSError:
+        return False
+    if not stat.S_ISREG(dest_st.st_mode) or src_st.st_size != dest_st.st_size:
+        return False
+    with open(src, "rb") as fsrc, open(dest, "rb") as fdest:
+        while True:
+            chunk = fsrc.read(COPY_CHUNK_SIZE)
+            if chunk != fdest.read(COPY_CHUNK_SIZE):
+                return False
+            if not chunk:
+                return True
+
+def _copy_file(src: str, dest: str) -> None:
+    """Copy file contents only, using in-kernel sendfile on Linux."""
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+        offset = 0
+        if sys.platform.startswith("linux"):
+            try:
+                size = os.fstat(fsrc.fileno()).st_size
+                while offset < size:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    if not sent:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                if offset:
+                    raise
+        shutil.copyfileobj(fsrc, fdst)
+
+def _copy_files(pairs: List[Tuple[str, str]]) -> None:
+    """Copy (src, dest) pairs, fanning out to a thread pool for larger batches."""
+    cpus = os.cpu_count() or 1
+    if len(pairs) < PARALLEL_COPY_THRESHOLD or cpus == 1:
+        for src, dest in pairs:
+            _copy_file(src, dest)
+        return
 
-    return scripts, packages
+    from concurrent.futures import ThreadPoolExecutor  # only needed for large batches
+    with ThreadPoolExecutor(max_workers=min(8, cpus * 2)) as pool:
+        futures = [pool.submit(_copy_file, src, dest) for src, dest in pairs]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
 def copy_script_package(
     package_path: Path,
-    target_dir: Path,
+    target_dir: StrPath,
     assume_yes: bool,
     txn: InstallationTransaction
 ) -> List[Path]:
     """Copy a script package to target_dir, tracking all operations for rollback."""
     logger.info(f"Installing script package: {package_path.name}")
-    successfully_copied = []
-
-    for src in package_path.rglob('*'):
-        if src.is_dir() or src.name in SKIP_FILES:
-            continue
-
-        dest = target_dir / src.relative_to(package_path)
-        rel = dest.relative_to(target_dir)
-
-        # Track and create any missing parent directories
-        for parent in reversed(list(dest.parents)):
-            try:
-                parent.relative_to(target_dir)
-            except ValueError:
+    target_prefix = os.path.join(os.fspath(target_dir), "")
+    planned: List[Tuple[str, str, str, bool]] = []
+    n_conflicts = 0
+    existing: Dict[str, Optional[Set[str]]] = {"": _existing_names(target_prefix)}
+
+    def ensure_dir(rel_dir: str) -> Optional[Set[str]]:
+        """Create rel_dir under target_dir if needed; return its existing names."""
+        if rel_dir in existing:
+            return existing[rel_dir]
+        parent = os.path.dirname(rel_dir[:-1])
+        ensure_dir(parent + os.sep if parent else "")
+        dest_dir = target_prefix + rel_dir
+        try:
+            os.mkdir(dest_dir)
+        except FileExistsError:
+            existing[rel_dir] = _existing_names(dest_dir)
+        else:
+            existing[rel_dir] = set()
+            txn.track_directory_creation(dest_dir)
+        return existing[rel_dir]
+
+    for src, rel_dir, name in _walk_package(os.fspath(package_path)):
+        rel = rel_dir + name
+        dest = target_prefix + rel
+
+        names = ensure_dir(rel_dir)
+        conflict = False
+        if (names is None or name.casefold() in names) and os.path.exists(dest):
+            if os.path.isdir(dest):
+                raise IsADirectoryError(f"Cannot install '{rel}': a directory with that name already exists.")
+            if _same_contents(src, dest):
+                logger.debug(f"Unchanged: {rel}")
                 continue
-            if parent != target_dir and not parent.exists():
-                txn.track_directory_creation(parent)
-        dest.parent.mkdir(parents=True, exist_ok=True)
-
-        if dest.exists() and not assume_yes:
-            if not prompt_yes_no(f"'{rel}' already exists. Overwrite?"):
+            conflict = True
+            n_conflicts += 1
+        planned.append((src, dest, rel, conflict))
+
+    policy = "overwrite" if assume_yes or not n_conflicts else "prompt"
+    if policy == "prompt" and n_conflicts > 1:
+        conflicts = [rel for _src, _dest, rel, conflict in planned if conflict]
+        shown = "\n".join(f"  - {rel}" for rel in conflicts[:10])
+        if n_conflicts > 10:
+            shown += f"\n  ... and {n_conflicts - 10} more"
+        logger.info(f"{n_conflicts} files from {package_path.name} already exist:\n{shown}")
+        policy = prompt_choice("Overwrite them?", ("overwrite", "skip", "prompt")) or "skip"
+
+    to_copy: List[Tuple[str, str]] = []
+    rels: List[str] = []
+    for src, dest, rel, conflict in planned:
+        backup = None
+        if conflict:
+            if policy == "skip" or (
+                policy == "prompt" and not prompt_yes_no(f"'{rel}' already exists. Overwrite?")
+            ):
                 logger.info(f"Skipped: {rel}")
                 continue
-
-        # Back up any pre-existing file so rollback can restore it
-        backup = None
-        if dest.exists():
-            backup = dest.with_suffix(dest.suffix + ".usl_backup")
-            shutil.copy2(dest, backup)
+            # Back up any pre-existing file so rollback can restore it
+            backup = dest + ".usl_backup"
+            os.replace(dest, backup)
 
         txn.track_file_operation(dest, original_backup=backup)
-        shutil.copy2(src, dest)
-        successfully_copied.append(dest)
-        logger.info(f"Copied: {rel}")
+        to_copy.append((src, dest))
+        rels.append(rel)
 
-    logger.info(f"Successfully installed script package: {package_path.name}")
-    return successfully_copied
+    _copy_files(to_copy)
+    if rels and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Copied:\n" + "\n".join(f"  {rel}" for rel in rels))
+
+    logger.info(f"Successfully installed script package: {package_path.name} ({len(rels)} files copied)")
+    return [Path(dest) for _src, dest in to_copy]
 
 def init_git_repo(path: Path, assume_yes: bool) -> None:
     if is_git_repo(path):
@@ -322,13 +579,15 @@ def init_git_repo(path: Path, assume_yes: bool) -> None:
         return
     if not prompt_yes_no("No git repository found. Initialize one?", assume_yes):
         return
+    import subprocess  # only needed for --init-git
+    env = {k: v for k, v in os.environ.items() if not k.startswith("GIT_")}
     try:
-        result = subprocess.run(
-            ["git", "init"], cwd=path, check=True, capture_output=True, text=True
+        subprocess.run(
+            ["git", "init", "-q"], cwd=path, check=True, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
         )
+        _project_flags.cache_clear()
         logger.info("Initialized a new git repository.")
-        if result.stdout:
-            logger.debug(f"Git output: {result.stdout.strip()}")
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to initialize git repository: {e}")
         if e.stderr:
@@ -351,51 +610,43 @@ def add_package_to_manifest(package_id: str, manifest: Dict) -> bool:
 
 # --- Command Handlers ---
 
-def cmd_list_scripts(scripts: List[Path]) -> None:
-    logger.info("Available USL scripts:")
+def cmd_list_scripts(scripts: Dict[str, Path]) -> None:
     if not scripts:
-        logger.info("  (No scripts found)")
+        logger.info("Available USL scripts:\n  (No scripts found)")
         return
-    for s in scripts:
-        logger.info(f"  - {s.name}")
+    logger.info("Available USL scripts:\n" + "\n".join(f"  - {name}" for name in scripts))
 
 def cmd_add_scripts(
-    all_available_scripts: List[Path],
+    name_map: Dict[str, Path],
     script_names: List[str],
-    project_assets: Path,
+    project_assets: StrPath,
     project_path: Path,
     assume_yes: bool
 ) -> None:
     """Add script packages with full dependency resolution."""
-    name_map = {s.name: s for s in all_available_scripts}
-    scripts_to_copy: Set[Path] = set()
-    packages_to_install: Set[str] = set()
-
     for name in script_names:
         if name not in name_map:
-            suggestions = difflib.get_close_matches(name, name_map.keys(), n=3, cutoff=0.6)
-            msg = f"Primary script not found: {name}"
-            if suggestions:
-                msg += "\nDid you mean one of these?\n" + "\n".join(f"  - {s}" for s in suggestions)
-            raise DependencyNotFoundError(msg)
-        scripts, packages = resolve_script_dependencies(name_map[name], name_map)
-        scripts_to_copy.update(scripts)
-        packages_to_install.update(packages)
+            raise DependencyNotFoundError(_with_suggestions(
+                f"Primary script not found: {name}", name, tuple(name_map)
+            ))
+
+    scripts_to_copy, packages_to_install = resolve_script_dependencies(script_names, name_map)
 
     if not scripts_to_copy and not packages_to_install:
         logger.info("No scripts or packages to add after dependency resolution.")
         return
 
-    logger.info("\n--- Installation Plan ---")
+    sorted_packages = sorted(packages_to_install)
+
+    plan = ["\n--- Installation Plan ---"]
     if scripts_to_copy:
-        logger.info("The following script packages will be copied:")
-        for p in sorted(scripts_to_copy, key=lambda p: p.name):
-            logger.info(f"  - {p.name}")
-    if packages_to_install:
-        logger.info("The following Unity packages will be added to manifest.json:")
-        for pkg in sorted(packages_to_install):
-            logger.info(f"  - {pkg}")
-    logger.info("-------------------------\n")
+        plan.append("The following script packages will be copied (in this order):")
+        plan.extend(f"  - {p.name}" for p in scripts_to_copy)
+    if sorted_packages:
+        plan.append("The following Unity packages will be added to manifest.json:")
+        plan.extend(f"  - {pkg}" for pkg in sorted_packages)
+    plan.append("-------------------------\n")
+    logger.info("\n".join(plan))
 
     if not prompt_yes_no("Proceed with installation?", assume_yes):
         logger.info("Installation cancelled by user.")
@@ -404,21 +655,22 @@ def cmd_add_scripts(
     logger.info("\nStarting installation...")
     manifest_path = project_path / UNITY_PACKAGES_MANIFEST
 
-    with InstallationTransaction(manifest_path) as txn:
-        if manifest_path.exists():
-            manifest_data = load_manifest(manifest_path)
-        else:
-            logger.info(f"Unity package manifest not found at '{manifest_path}'. Creating a new one.")
-            manifest_data = {"dependencies": {}}
-
-        for pkg_id in sorted(packages_to_install):
-            add_package_to_manifest(pkg_id, manifest_data)
-
-        if packages_to_install:
-            write_manifest_atomic(manifest_path, manifest_data)
-            logger.info(f"Updated Unity package manifest at '{manifest_path}'.")
-
-        for script_path in sorted(scripts_to_copy, key=lambda p: p.name):
+    with InstallationTransaction(manifest_path, project_assets) as txn:
+        if sorted_packages:
+            if manifest_path.exists():
+                manifest_data = load_manifest(manifest_path)
+            else:
+                logger.info(f"Unity package manifest not found at '{manifest_path}'. Creating a new one.")
+                manifest_data = {"dependencies": {}}
+
+            # A list, not any(): every package must be added
+            added = [add_package_to_manifest(pkg_id, manifest_data) for pkg_id in sorted_packages]
+            if any(added):
+                txn.backup_manifest()
+                write_manifest_atomic(manifest_path, manifest_data)
+                logger.info(f"Updated Unity package manifest at '{manifest_path}'.")
+
+        for script_path in scripts_to_copy:
             copy_script_package(script_path, project_assets, assume_yes, txn)
 
         txn.commit()
@@ -439,104 +691,158 @@ def cmd_install_package(package_id: str, project_path: Path) -> None:
     logger.info(f"Added '{package_id}' to the project's package manifest.")
     logger.info("Note: '*' was used for version. Unity will resolve to the latest compatible version.")
 
-def cmd_interactive_mode(project_assets: Path, project_path: Path) -> None:
+def cmd_interactive_mode(scripts: Dict[str, Path], project_assets: StrPath, project_path: Path) -> None:
     """Run interactive script selection mode (incompatible with --yes; enforced by run_command)."""
-    scripts = scan_scripts(SCRIPTS_DIR)
     if not scripts:
         logger.info("No local scripts available to install.")
         return
 
-    logger.info("Available scripts:")
-    for idx, s in enumerate(scripts, 1):
-        logger.info(f"{idx}. {s.name}")
+    names = list(scripts)
+    logger.info("Available scripts:\n" + "\n".join(f"{idx}. {name}" for idx, name in enumerate(names, 1)))
 
-    selection = ""
     try:
         selection = input("Enter numbers to add (e.g., 1 3 5 or 1,2,3), or leave blank to cancel: ").strip()
-        if not selection:
-            logger.info("Operation cancelled.")
-            return
-
-        tokens = [t for t in re.split(r'[,\s]+', selection) if t]
-        indexes = [int(i) - 1 for i in tokens]
-        selected = [scripts[i] for i in indexes if 0 <= i < len(scripts)]
-
-        if not selected:
-            raise ValueError("No valid scripts selected.")
+    except EOFError:
+        selection = ""
+    if not selection:
+        logger.info("Operation cancelled.")
+        return
 
-        cmd_add_scripts(scripts, [s.name for s in selected], project_assets, project_path, assume_yes=False)
+    count = len(names)
+    selected: List[str] = []
+    invalid: List[str] = []
+    for token in SELECTION_SEPARATOR.split(selection):
+        if not token:
+            continue
+        try:
+            i = int(token) - 1
+        except ValueError:
+            invalid.append(token)
+            continue
+        if 0 <= i < count:
+            selected.append(names[i])
+        else:
+            invalid.append(token)
 
-    except (ValueError, IndexError):
+    if not selected:
         raise ValueError(
             f"Invalid input: '{selection}'\n"
-            "Please enter numbers (e.g., '1 3 5' or '1,2,3')"
+            f"Please enter numbers between 1 and {count} (e.g., '1 3 5' or '1,2,3')"
         )
+    if invalid:
+        logger.warning(f"Ignoring invalid selection(s): {', '.join(invalid)}")
+
+    cmd_add_scripts(scripts, selected, project_assets, project_path, assume_yes=False)
 
 
 # --- CLI ---
 
-def parse_args():
+def _add_shared_flags(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    """Add the flags every subcommand accepts."""
+    parser.add_argument("-y", "--yes", action="store_true", help="Automatically answer yes to all prompts.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging.")
+    return parser
+
+@functools.lru_cache(maxsize=None)
+def _build_parser() -> argparse.ArgumentParser:
+    """Build the CLI parser (cached)."""
     parser = argparse.ArgumentParser(
         prog="usl",
         description="Unity Script Library - manage scripts and packages in Unity projects."
     )
     parser.add_argument("--init-git", action="store_true", help="Initialize a git repo if one doesn't exist.")
 
-    # Shared flags on a parent parser — the standard argparse pattern for
-    # flags that belong to every subcommand. add_help=False prevents argparse
-    # from adding a duplicate -h when the parent is inherited.
-    shared = argparse.ArgumentParser(add_help=False)
-    shared.add_argument("-y", "--yes", action="store_true", help="Automatically answer yes to all prompts.")
-    shared.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging.")
-
+    # No command means interactive mode
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
-    subparsers.add_parser("list", parents=[shared], help="List available local script packages.")
+    _add_shared_flags(subparsers.add_parser("list", help="List available local script packages."))
 
-    add_parser = subparsers.add_parser("add", parents=[shared], help="Add local script packages to the Unity project.")
+    add_parser = _add_shared_flags(subparsers.add_parser("add", help="Add local script packages to the Unity project."))
     add_parser.add_argument("scripts", nargs="+", metavar="SCRIPT", help="Script package names to add.")
 
-    install_parser = subparsers.add_parser("install", parents=[shared], help="Install a Unity package by its ID.")
+    install_parser = _add_shared_flags(subparsers.add_parser("install", help="Install a Unity package by its ID."))
     install_parser.add_argument("package_id", metavar="PACKAGE_ID", help="Unity package ID (e.g., com.unity.inputsystem).")
 
-    return parser.parse_args()
+    return parser
 
-def run_command(args, cwd: Path) -> int:
-    if getattr(args, "verbose", False):
-        logger.setLevel(logging.DEBUG)
+def parse_args(argv: Optional[List[str]] = None):
+    return _build_parser().parse_args(argv)
 
-    if not SCRIPTS_DIR.exists():
-        logger.error(f"Error: Scripts directory not found at: {SCRIPTS_DIR}")
+def _load_scripts() -> Optional[Dict[str, Path]]:
+    """Scan the library's scripts folder, or log an error and return None."""
+    scripts_dir = _scripts_dir()
+    if not scripts_dir.exists():
+        logger.error(f"Error: Scripts directory not found at: {scripts_dir}")
         logger.error("Please create it or run from the correct location.")
-        return 1
+        return None
+    return scan_scripts(scripts_dir)
 
-    assume_yes = getattr(args, "yes", False)
+def _check_project(cwd: Path) -> bool:
+    """Return True if cwd is a Unity project, logging why not otherwise."""
+    if is_unity_project(cwd):
+        return True
+    logger.error("Error: This command must be run from a Unity project directory.")
+    logger.error("       (Expected to find 'Assets' and 'ProjectSettings' subdirectories.)")
+    return False
 
-    if args.command == "list":
-        cmd_list_scripts(scan_scripts(SCRIPTS_DIR))
-        return 0
 
-    if not is_unity_project(cwd):
-        logger.error("Error: This command must be run from a Unity project directory.")
-        logger.error("       (Expected to find 'Assets' and 'ProjectSettings' subdirectories.)")
+def _run_list(args, cwd: Path) -> int:
+    scripts = _load_scripts()
+    if scripts is None:
         return 1
+    cmd_list_scripts(scripts)
+    return 0
 
+def _run_add(args, cwd: Path) -> int:
+    if not _check_project(cwd):
+        return 1
+    scripts = _load_scripts()
+    if scripts is None:
+        return 1
+    if args.init_git:
+        init_git_repo(cwd, args.yes)
+    cmd_add_scripts(scripts, args.scripts, os.path.join(cwd, "Assets"), cwd, args.yes)
+    return 0
+
+def _run_install(args, cwd: Path) -> int:
+    if not _check_project(cwd):
+        return 1
+    if args.init_git:
+        init_git_repo(cwd, args.yes)
+    cmd_install_package(args.package_id, cwd)
+    return 0
+
+def _run_interactive(args, cwd: Path) -> int:
+    if getattr(args, "yes", False):
+        logger.error("Error: Interactive mode cannot be used with --yes flag.")
+        logger.error("Please specify scripts to add or remove --yes flag.")
+        return 1
+    if not _check_project(cwd):
+        return 1
+    scripts = _load_scripts()
+    if scripts is None:
+        return 1
     if args.init_git:
-        init_git_repo(cwd, assume_yes)
+        init_git_repo(cwd, False)
+    logger.info("No command specified. Entering interactive mode...")
+    cmd_interactive_mode(scripts, os.path.join(cwd, "Assets"), cwd)
+    return 0
+
+_COMMANDS = {
+    "list": _run_list,
+    "add": _run_add,
+    "install": _run_install,
+    None: _run_interactive,
+}
+
+def run_command(args, cwd: Path) -> int:
+    if getattr(args, "verbose", False):
+        logger.setLevel(logging.DEBUG)
+    _project_flags.cache_clear()
 
     try:
-        if args.command == "add":
-            cmd_add_scripts(scan_scripts(SCRIPTS_DIR), args.scripts, cwd / "Assets", cwd, assume_yes)
-        elif args.command == "install":
-            cmd_install_package(args.package_id, cwd)
-        else:  # interactive mode
-            if assume_yes:
-                logger.error("Error: Interactive mode cannot be used with --yes flag.")
-                logger.error("Please specify scripts to add or remove --yes flag.")
-                return 1
-            logger.info("No command specified. Entering interactive mode...")
-            cmd_interactive_mode(cwd / "Assets", cwd)
-        return 0
-    except (DependencyNotFoundError, InvalidDependencyFileError, ManifestError, ValueError) as e:
+        return _COMMANDS[args.command](args, cwd)
+    except (DependencyNotFoundError, InvalidDependencyFileError, CyclicDependencyError,
+            ManifestError, ValueError) as e:
         logger.error(f"Error: {e}")
         return 1
     except KeyboardInterrupt:
@@ -544,7 +850,7 @@ def run_command(args, cwd: Path) -> int:
         return 130
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-        if args.verbose:
+        if getattr(args, "verbose", False):
             import traceback
             traceback.print_exc()
         return 2